@@ -3,16 +3,26 @@ import argparse
 import json
 import os
 import re
+import shlex
 import subprocess
 import sys
 import warnings
 from copy import copy
 from copy import deepcopy
+from functools import lru_cache
+from itertools import chain
 
 
 # - Dockerfile converter ---------------------------------------------------------------------------
 
 
+_FROM_AS_RE = re.compile(r"AS (?P<layer>.+)", re.IGNORECASE)
+_AS_STRIP_RE = re.compile(r"AS .+", re.IGNORECASE)
+_ENV_TOKEN_RE = re.compile(r"""( |".*?"|'.*?')""")
+_MULTI_NL_RE = re.compile(r"\n{2,}")
+_DOLLAR_AT_RE = re.compile(r'"?\$@"?')
+
+
 class Recipe:
     """
     taken and modified from https://github.com/singularityhub/singularity-cli
@@ -35,6 +45,22 @@ class Recipe:
 
     """
 
+    _JSON_ATTRIBS = (
+        "cmd",
+        "comments",
+        "entrypoint",
+        "environ",
+        "files",
+        "fromHeader",
+        "layer_files",
+        "install",
+        "labels",
+        "ports",
+        "test",
+        "volumes",
+        "workdir",
+    )
+
     def __init__(self, recipe=None, layer=1):
         self.cmd = None
         self.comments = []
@@ -74,30 +100,7 @@ class Recipe:
                  test, volumes, and workdir, organized by layer for
                  multistage builds.
         """
-        attributes = [
-            "cmd",
-            "comments",
-            "entrypoint",
-            "environ",
-            "files",
-            "fromHeader",
-            "layer_files",
-            "install",
-            "labels",
-            "ports",
-            "test",
-            "volumes",
-            "workdir",
-        ]
-
-        result = {}
-
-        for attrib in attributes:
-            value = getattr(self, attrib)
-            if value:
-                result[attrib] = value
-
-        return result
+        return {attrib: value for attrib in self._JSON_ATTRIBS if (value := getattr(self, attrib))}
 
     def __repr__(self):
         return self.__str__()
@@ -114,7 +117,26 @@ class DockerParser:
 
     name = "docker"
 
-    def __init__(self, filename="Dockerfile", load=True):
+    # Dockerfile keywords and the names of the methods parsing them
+    _MAPPING = {
+        "ADD": "_add",
+        "ARG": "_arg",
+        "COPY": "_copy",
+        "CMD": "_cmd",
+        "ENTRYPOINT": "_entry",
+        "ENV": "_env",
+        "EXPOSE": "_expose",
+        "FROM": "_from",
+        "HEALTHCHECK": "_test",
+        "RUN": "_run",
+        "WORKDIR": "_workdir",
+        "MAINTAINER": "_label",
+        "VOLUME": "_volume",
+        "LABEL": "_label",
+        "STOPSIGNAL": "_stopsignal",
+    }
+
+    def __init__(self, filename="Dockerfile", load=True, verbose=False):
         """a generic recipe parser holds the original file, and provides
         shared functions for interacting with files. If the subclass has
         a parse function defined, we parse the filename
@@ -124,28 +146,33 @@ class DockerParser:
         filename: the recipe file to parse.
         load: if True, load the filename into the Recipe. If not loaded,
               the user can call self.parse() at a later time.
+        verbose: if True, echo every parsed line and directive. Warnings
+                 are printed regardless.
 
         """
         self.filename = filename
+        self.verbose = verbose
         self._run_checks()
-        self.lines = []
+
+        # Bind the keyword parsers once, instead of on every line
+        self._mapping = {cmd: getattr(self, name) for cmd, name in self._MAPPING.items()}
 
         # Arguments can be used internally, active layer name and number
         self.args = {}
+        self._args_re = None
+        self._exists_cache = {}
         self.active_layer = "spython-base"
         self.active_layer_num = 1
 
         # Support multistage builds
         self.recipe = {"spython-base": Recipe(self.filename)}
 
-        if self.filename:
-            # Read in the raw lines of the file
-            with open(self.filename, "r") as filey:
-                self.lines = filey.readlines()
+        # The recipe of the active layer, kept in sync with active_layer
+        self._active = self.recipe[self.active_layer]
 
-            # If parsing function defined, parse the recipe
-            if load:
-                self.parse()
+        # If parsing function defined, parse the recipe
+        if self.filename and load:
+            self.parse()
 
     def __str__(self):
         """show the user the recipe object, along with the type. E.g.,
@@ -201,19 +228,20 @@ class DockerParser:
         fromHeader: the fromHeader parsed from self.from, possibly with AS
         """
         # Derive if there is a named layer
-        match = re.search("AS (?P<layer>.+)", fromHeader, flags=re.I)
+        match = _FROM_AS_RE.search(fromHeader)
         if match:
             layer = match.groups("layer")[0].strip()
 
             # If it's the first layer named incorrectly, we need to rename
-            if len(self.recipe) == 1 and list(self.recipe)[0] == "spython-base":
-                self.recipe[layer] = deepcopy(self.recipe[self.active_layer])
-                del self.recipe[self.active_layer]
+            if len(self.recipe) == 1 and next(iter(self.recipe)) == "spython-base":
+                self.recipe[layer] = self.recipe.pop(self.active_layer)
             else:
                 self.active_layer_num += 1
                 self.recipe[layer] = Recipe(self.filename, self.active_layer_num)
             self.active_layer = layer
-            print("Active layer #%s updated to %s" % (self.active_layer_num, self.active_layer))
+            self._active = self.recipe[layer]
+            if self.verbose:
+                print("Active layer #%s updated to %s" % (self.active_layer_num, self.active_layer))
 
     def _replace_from_dict(self, string, args):
         """Given a lookup of arguments, args, replace any that are found in
@@ -229,10 +257,14 @@ class DockerParser:
         =======
         string: the string with replacements made
         """
-        for key, value in args.items():
-            if re.search("([$]" + key + "|[$][{]" + key + "[}])", string):
-                string = re.sub("([$]" + key + "|[$]{" + key + "[}])", value, string)
-        return string
+        if not args:
+            return string
+
+        # A single alternation over all keys, rebuilt only when _arg adds a new key
+        if self._args_re is None:
+            keys = "|".join(map(re.escape, args))
+            self._args_re = re.compile(r"\$(?:\{(" + keys + r")\}|(" + keys + "))")
+        return self._args_re.sub(lambda match: args[match.group(1) or match.group(2)], string)
 
     def parse(self):
         """parse is the base function for parsing the Dockerfile, and extracting
@@ -252,14 +284,16 @@ class DockerParser:
         parser = None
         previous = None
 
-        for line in self.lines:
-            parser = self._get_mapping(line, parser, previous)
+        # Stream the raw lines of the file instead of reading them all up front
+        with open(self.filename, "r") as filey:
+            for line in filey:
+                parser = self._get_mapping(line, parser, previous)
 
-            # Parse it, if appropriate
-            if parser:
-                parser(line)
+                # Parse it, if appropriate
+                if parser:
+                    parser(line)
 
-            previous = line
+                previous = line
 
         # Instantiated by ParserBase
         return self.recipe
@@ -270,16 +304,16 @@ class DockerParser:
         """replace the command name from the group, alert the user of content,
         and clean up empty spaces
         """
-        print("[in]  %s" % line)
-
-        # Replace ACTION at beginning
-        line = re.sub("^%s" % action, "", line)
+        if self.verbose:
+            print("[in]  %s" % line)
 
-        # Handle continuation lines without ACTION by padding with leading space
-        line = " " + line
+        # Replace ACTION at beginning, continuation lines come without it
+        if line.startswith(action):
+            line = line[len(action) :]
 
-        # Split into components
-        return [x for x in self._split_line(line) if x not in ["", None]]
+        # The remainder is kept as a single component, if not empty
+        line = line.strip()
+        return [line] if line else []
 
     # From Parser
 
@@ -299,13 +333,13 @@ class DockerParser:
         self._multistage(fromHeader[0])
 
         # Now extract the from header, make args replacements
-        self.recipe[self.active_layer].fromHeader = self._replace_from_dict(
-            re.sub("AS .+", "", fromHeader[0], flags=re.I), self.args
-        )
+        recipe = self._active
+        recipe.fromHeader = self._replace_from_dict(_AS_STRIP_RE.sub("", fromHeader[0]), self.args)
 
-        if "scratch" in self.recipe[self.active_layer].fromHeader:
+        if "scratch" in recipe.fromHeader:
             print("scratch is no longer available on Docker Hub.")
-        print("FROM %s" % self.recipe[self.active_layer].fromHeader)
+        if self.verbose:
+            print("FROM %s" % recipe.fromHeader)
 
     # Run and Test Parser
 
@@ -318,7 +352,7 @@ class DockerParser:
 
         """
         line = self._setup("RUN", line)
-        self.recipe[self.active_layer].install += line
+        self._active.install.extend(line)
 
     def _test(self, line):
         """A healthcheck is generally a test command
@@ -328,7 +362,7 @@ class DockerParser:
         line: the line from the recipe file to parse for FROM
 
         """
-        self.recipe[self.active_layer].test = self._setup("HEALTHCHECK", line)
+        self._active.test = self._setup("HEALTHCHECK", line)
 
     # Arg Parser
 
@@ -346,7 +380,7 @@ class DockerParser:
 
         # Args are treated like envars, so we add them to install
         environ = self.parse_env([x for x in line if "=" in x])
-        self.recipe[self.active_layer].install += environ
+        self._active.install.extend(environ)
 
         # Try to extract arguments from the line
         for arg in line:
@@ -361,7 +395,10 @@ class DockerParser:
             arg, value = arg.split("=", 1)
             arg = arg.strip()
             value = value.strip()
-            print("Updating ARG %s to %s" % (arg, value))
+            if self.verbose:
+                print("Updating ARG %s to %s" % (arg, value))
+            if arg not in self.args:
+                self._args_re = None
             self.args[arg] = value
 
     # Env Parser
@@ -380,11 +417,13 @@ class DockerParser:
         # Extract environment (list) from the line
         environ = self.parse_env(line)
 
+        recipe = self._active
+
         # Add to global environment, run during install
-        self.recipe[self.active_layer].install += environ
+        recipe.install.extend(environ)
 
         # Also define for global environment
-        self.recipe[self.active_layer].environ += environ
+        recipe.environ.extend(environ)
 
     def parse_env(self, envlist):
         """parse_env will parse a single line (with prefix like ENV removed) to
@@ -399,19 +438,23 @@ class DockerParser:
         exports = []
 
         for env in envlist:
-            pieces = re.split("( |\\\".*?\\\"|'.*?')", env)
+            pieces = _ENV_TOKEN_RE.split(env)
             pieces = [p for p in pieces if p.strip()]
 
-            while pieces:
-                current = pieces.pop(0)
+            # Walk the pieces by index, popping from the front is O(n) each
+            i = 0
+            while i < len(pieces):
+                current = pieces[i]
+                i += 1
 
                 if current.endswith("="):
                     # Case 1: ['A='] --> A=
                     nextone = ""
 
                     # Case 2: ['A=', '"1 2"'] --> A=1 2
-                    if pieces:
-                        nextone = pieces.pop(0)
+                    if i < len(pieces):
+                        nextone = pieces[i]
+                        i += 1
                     exports.append("export %s%s" % (current, nextone))
 
                 # Case 3: ['A=B']     --> A=B
@@ -424,7 +467,8 @@ class DockerParser:
 
                 # Case 5: ['A', 'B']  --> A=B
                 else:
-                    nextone = pieces.pop(0)
+                    nextone = pieces[i]
+                    i += 1
                     exports.append("export %s=%s" % (current, nextone))
 
         return exports
@@ -481,7 +525,7 @@ class DockerParser:
                     self._parse_http(frompath, topath)
 
             # Add the file, and decompress in install
-            elif re.search("[.](gz|gzip|bz2|xz)$", frompath.strip()):
+            elif frompath.strip().endswith((".gz", ".gzip", ".bz2", ".xz")):
                 for topath in values:
                     self._parse_archive(frompath, topath)
 
@@ -508,19 +552,25 @@ class DockerParser:
         if "*" in source:
             print("Singularity doesn't support expansion, * found in %s" % source)
 
-        # Warning if file/folder (src) doesn't exist
-        if not os.path.exists(source) and layer is None:
-            print("%s doesn't exist, ensure exists for build" % source)
+        # Warning if file/folder (src) doesn't exist, a pattern can't be checked
+        elif layer is None:
+            exists = self._exists_cache.get(source)
+            if exists is None:
+                exists = self._exists_cache[source] = os.path.exists(source)
+            if not exists:
+                print("%s doesn't exist, ensure exists for build" % source)
+
+        recipe = self._active
 
         # The pair is added to the files as a list
         if not layer:
-            self.recipe[self.active_layer].files.append([source, dest])
+            recipe.files.append([source, dest])
 
         # Unless the file is to be copied from a particular layer
         else:
-            if layer not in self.recipe[self.active_layer].layer_files:
-                self.recipe[self.active_layer].layer_files[layer] = []
-            self.recipe[self.active_layer].layer_files[layer].append([source, dest])
+            if layer not in recipe.layer_files:
+                recipe.layer_files[layer] = []
+            recipe.layer_files[layer].append([source, dest])
 
     def _parse_http(self, url, dest):
         """will get the filename of an http address, and return a statement
@@ -535,7 +585,7 @@ class DockerParser:
         file_name = os.path.basename(url)
         download_path = "%s/%s" % (dest, file_name)
         command = "curl %s -o %s" % (url, download_path)
-        self.recipe[self.active_layer].install.append(command)
+        self._active.install.append(command)
 
     def _parse_archive(self, targz, dest):
         """parse_targz will add a line to the install script to extract a
@@ -549,36 +599,26 @@ class DockerParser:
         """
 
         # Add command to extract it
-        self.recipe[self.active_layer].install.append("tar -zvf %s %s" % (targz, dest))
+        self._active.install.append("tar -zvf %s %s" % (targz, dest))
 
         # Ensure added to container files
         return self._add_files(targz, dest)
 
     # Comments and Default
 
-    def _comment(self, line):
-        """Simply add the line to the install as a comment. This function is
-        equivalent to default, but added in the case we need future custom
-        parsing (meaning a comment is different from a line.
-
-        Parameters
-        ==========
-        line: the line from the recipe file to parse to INSTALL
-
-        """
-        self.recipe[self.active_layer].install.append(line)
-
     def _default(self, line):
         """the default action assumes a line that is either a command (a
-        continuation of a previous, for example) or a comment.
+        continuation of a previous, for example) or a comment. Both are
+        simply added to the install.
 
         Parameters
         ==========
         line: the line from the recipe file to parse to INSTALL
         """
-        if line.strip().startswith("#"):
-            return self._comment(line)
-        self.recipe[self.active_layer].install.append(line)
+        self._active.install.append(line)
+
+    # A comment is currently handled just like the default
+    _comment = _default
 
     # Ports and Volumes
 
@@ -594,7 +634,7 @@ class DockerParser:
         """
         volumes = self._setup("VOLUME", line)
         if volumes:
-            self.recipe[self.active_layer].volumes += volumes
+            self._active.volumes.extend(volumes)
         return self._comment("# %s" % line)
 
     def _expose(self, line):
@@ -607,7 +647,7 @@ class DockerParser:
         """
         ports = self._setup("EXPOSE", line)
         if ports:
-            self.recipe[self.active_layer].ports += ports
+            self._active.ports.extend(ports)
         return self._comment("# %s" % line)
 
     def _stopsignal(self, line):
@@ -631,11 +671,12 @@ class DockerParser:
         """
         # Save the last working directory to add to the runscript
         workdir = self._setup("WORKDIR", line)
+        recipe = self._active
         workdir_mkdir = "mkdir -p %s" % ("".join(workdir))
-        self.recipe[self.active_layer].install.append(workdir_mkdir)
+        recipe.install.append(workdir_mkdir)
         workdir_cd = "cd %s" % ("".join(workdir))
-        self.recipe[self.active_layer].install.append(workdir_cd)
-        self.recipe[self.active_layer].workdir = workdir[0]
+        recipe.install.append(workdir_cd)
+        recipe.workdir = workdir[0]
 
     # Entrypoint and Command
 
@@ -651,7 +692,7 @@ class DockerParser:
 
         """
         cmd = self._setup("CMD", line)[0]
-        self.recipe[self.active_layer].cmd = self._load_list(cmd)
+        self._active.cmd = self._load_list(cmd)
 
     def _load_list(self, line):
         """load an entrypoint or command, meaning it can be wrapped in a list
@@ -675,7 +716,7 @@ class DockerParser:
 
         """
         entrypoint = self._setup("ENTRYPOINT", line)[0]
-        self.recipe[self.active_layer].entrypoint = self._load_list(entrypoint)
+        self._active.entrypoint = self._load_list(entrypoint)
 
     # Labels
 
@@ -688,7 +729,7 @@ class DockerParser:
 
         """
         label = self._setup("LABEL", line)
-        self.recipe[self.active_layer].labels += [label]
+        self._active.labels.append(label)
 
     # Main Parsing Functions
 
@@ -716,36 +757,20 @@ class DockerParser:
         if not line:
             return None
 
-        cmd = line[0].upper()
-
-        mapping = {
-            "ADD": self._add,
-            "ARG": self._arg,
-            "COPY": self._copy,
-            "CMD": self._cmd,
-            "ENTRYPOINT": self._entry,
-            "ENV": self._env,
-            "EXPOSE": self._expose,
-            "FROM": self._from,
-            "HEALTHCHECK": self._test,
-            "RUN": self._run,
-            "WORKDIR": self._workdir,
-            "MAINTAINER": self._label,
-            "VOLUME": self._volume,
-            "LABEL": self._label,
-            "STOPSIGNAL": self._stopsignal,
-        }
+        # Keywords are usually uppercase already, only upper() on a miss
+        cmd = line[0]
+        function = self._mapping.get(cmd) or self._mapping.get(cmd.upper())
 
         # If it's a command line, return correct function
-        if cmd in mapping:
-            return mapping[cmd]
+        if function:
+            return function
 
-        # If it's a continued line, return previous
-        cleaned = self._clean_line(line[-1])
-        previous = self._clean_line(previous)
+        # If it's a continued line, return previous (inlined _clean_line)
+        if parser and line[-1].partition("#")[0].strip().endswith("\\"):
+            return parser
 
         # if we are continuing from last
-        if cleaned.endswith("\\") and parser or previous.endswith("\\"):
+        if previous and previous.partition("#")[0].strip().endswith("\\"):
             return parser
 
         return self._default
@@ -824,12 +849,10 @@ class SingularityWriter:
             print("%s exists, and force is False." % output_file)
             sys.exit(1)
 
-        # Do the conversion if function is provided by subclass
-        if hasattr(self, "convert"):
-            converted = self.convert()
-            print("Saving to %s" % output_file)
-            with open(output_file, "w") as filey:
-                filey.writelines(converted)
+        converted = self.convert()
+        print("Saving to %s" % output_file)
+        with open(output_file, "w") as filey:
+            filey.writelines(converted)
 
     def validate(self):
         """validate that all (required) fields are included for the Docker
@@ -865,9 +888,9 @@ class SingularityWriter:
                 print("Singularity recipe requires a from header.")
                 sys.exit(1)
 
-            recipe += ["\n\n\nBootstrap: docker"]
-            recipe += ["From: %s" % parser.fromHeader]
-            recipe += ["Stage: %s\n\n\n" % stage]
+            recipe.append(
+                "\n\n\nBootstrap: docker\nFrom: %s\nStage: %s\n\n\n" % (parser.fromHeader, stage)
+            )
 
             # TODO: stopped here - bug with files being found
             # Add global files, and then layer files
@@ -897,7 +920,7 @@ class SingularityWriter:
             count += 1
 
         # Clean up extra white spaces
-        recipe = "\n".join(recipe).replace("\n\n", "\n").strip("\n")
+        recipe = _MULTI_NL_RE.sub("\n", "\n".join(recipe)).strip("\n")
         return recipe.rstrip()
 
     def _create_runscript(self, default="", force=False):
@@ -912,31 +935,34 @@ class SingularityWriter:
                  an entrypoint or cmd.
         force: If true, use default and ignore Dockerfile settings
         """
-        entrypoint = default
+        # Collect the pieces and join them once at the end
+        parts = [default]
 
         # Only look at Docker if not enforcing default
         if not force:
-            if self.recipe[self.stage].entrypoint is not None:
-                # The provided entrypoint can be a string or a list
-                if isinstance(self.recipe[self.stage].entrypoint, list):
-                    entrypoint = " ".join(self.recipe[self.stage].entrypoint)
+            recipe = self.recipe[self.stage]
+
+            # The provided entrypoint can be a string or a list
+            if recipe.entrypoint is not None:
+                if isinstance(recipe.entrypoint, list):
+                    parts = [" ".join(recipe.entrypoint)]
                 else:
-                    entrypoint = "".join(self.recipe[self.stage].entrypoint)
+                    parts = [recipe.entrypoint]
 
-            if self.recipe[self.stage].cmd is not None:
-                if isinstance(self.recipe[self.stage].cmd, list):
-                    entrypoint = entrypoint + " " + " ".join(self.recipe[self.stage].cmd)
+            if recipe.cmd is not None:
+                if isinstance(recipe.cmd, list):
+                    parts.append(" ".join(recipe.cmd))
                 else:
-                    entrypoint = entrypoint + " " + "".join(self.recipe[self.stage].cmd)
+                    parts.append(recipe.cmd)
 
         # Entrypoint should use exec
-        if not entrypoint.startswith("exec"):
-            entrypoint = "exec %s" % entrypoint
+        if not parts[0].startswith("exec"):
+            parts.insert(0, "exec")
 
         # Should take input arguments into account
-        if not re.search('"?[$]@"?', entrypoint):
-            entrypoint = '%s "$@"' % entrypoint
-        return entrypoint
+        if not any(_DOLLAR_AT_RE.search(part) for part in parts):
+            parts.append('"$@"')
+        return " ".join(parts)
 
     def _create_section(self, attribute, name=None, stage=None):
         """create a section based on key, value recipe pairs,
@@ -996,9 +1022,9 @@ class SingularityWriter:
         # Convert USER lines to change user
         lines = []
         for line in section:
-            if re.search("^USER", line):
-                username = line.replace("USER", "", 1).rstrip()
-                line = "su - %s" % username + " # " + line
+            if line.startswith("USER"):
+                username = line[len("USER") :].rstrip()
+                line = f"su - {username} # {line}"
             lines.append(line)
 
         header = ["%" + name]
@@ -1038,11 +1064,10 @@ class SingularityWriter:
         return section
 
 
-def convert_dockerfile_to_apptainer(in_docker_context, out_apptainer_file):
-    for file in os.listdir(in_docker_context):
-        if file == "Dockerfile":
-            in_docker_file = remove_redundant_slashes(in_docker_context + "/" + file)
-    recipeParser = DockerParser(in_docker_file)
+def convert_dockerfile_to_apptainer(in_docker_context, out_apptainer_file, verbose=False):
+    # a missing Dockerfile is reported by DockerParser
+    in_docker_file = os.path.join(in_docker_context, "Dockerfile")
+    recipeParser = DockerParser(in_docker_file, verbose=verbose)
     recipeWriter = SingularityWriter(recipeParser.recipe)
     recipeWriter.write(out_apptainer_file)
 
@@ -1058,6 +1083,17 @@ class ParsingError(Exception):
 
 class ComposeService:
 
+    __slots__ = (
+        "name",
+        "image",
+        "def_file",
+        "sif_file",
+        "build",
+        "run_command",
+        "volumes",
+        "environment",
+    )
+
     def __init__(self):
         self.name = None
         self.image = None
@@ -1071,58 +1107,45 @@ class ComposeService:
     def command_to_list(self, args):
         l = ["apptainer"]
         if args.COMMAND == "build":
-            l += [
-                "build",
-                "-F",
-                self.sif_file,
-                self.def_file,
-            ]
+            l.extend(("build", "-F", self.sif_file, self.def_file))
         else:
-            if args.COMMAND == "up":
-                if self.run_command:
-                    l.append("run")
-                else:
-                    l.append("run")
-            elif args.COMMAND == "run":
+            if args.COMMAND in ["up", "run"]:
                 l.append("run")
             if args.writable_tmpfs:
                 l.append("--writable-tmpfs")
-            for vol in self.volumes.values():
-                l += ["--bind", vol]
-            if self.environment:
-                for k, v in self.environment.items():
-                    if v is not None:
-                        l += ["--env", k + "=" + v]
+            l.extend(chain.from_iterable(("--bind", vol) for vol in self.volumes.values()))
+            l.extend(
+                chain.from_iterable(
+                    ("--env", k + "=" + v) for k, v in self.environment.items() if v is not None
+                )
+            )
             if self.build:
-                l += [self.sif_file]
+                l.append(self.sif_file)
             elif self.image:
-                l += [self.image]
+                l.append(self.image)
             if args.COMMAND == "run":
-                l += args.run_command
+                l.extend(args.run_command)
             elif self.run_command:
-                l += self.run_command
+                l.extend(self.run_command)
         return l
 
-    def command_to_str(self, args):
-        s = ""
+    def command_to_str(self, args, command_list=None):
+        if command_list is None:
+            command_list = self.command_to_list(args)
+        parts = []
         prev = None
-        for e in self.command_to_list(args):
+        for e in command_list:
             if prev == "--env":
                 var, val = e.split("=")
-                s += f"{var}='{val}' "
+                parts.append(f"{var}='{val}'")
             else:
-                s += e + " "
+                parts.append(e)
             prev = e
-        s = s[:-1]
-        return s
+        return " ".join(parts)
 
     def __str__(self):
-        s = ""
-        for k, v in self.__dict__.items():
-            if v:
-                s += k + ": " + str(v) + ", "
-        s = "<class 'ComposeService': " + s[:-2] + ">"
-        return s
+        body = ", ".join(f"{k}: {v}" for k in self.__slots__ if (v := getattr(self, k)))
+        return f"<class 'ComposeService': {body}>"
 
     def __repr__(self):
         return str(self)
@@ -1130,43 +1153,59 @@ class ComposeService:
 
 class ComposeServiceContainer:
 
+    __slots__ = ("args", "compose_services", "_by_name")
+
     def __init__(self):
         self.args = None
         self.compose_services = []
+        self._by_name = None
+
+    def add(self, cs):
+        self.compose_services.append(cs)
+        # the index no longer matches the services
+        self._by_name = None
+
+    def by_name(self, name):
+        # the index is built on the first lookup by name and rebuilt after add
+        if self._by_name is None:
+            self._by_name = {cs.name: cs for cs in self.compose_services}
+        return self._by_name.get(name)
 
 
 class LineReader:
 
-    def __init__(self, file_path):
+    __slots__ = ("n", "line", "stripped", "indent", "generator", "parents")
+
+    def __init__(self, file_path, parents=None):
         self.n = None
         self.line = None
+        self.stripped = None
+        self.indent = 0
         self.generator = self.create_generator(file_path)
+        # parsed parent compose files of `extends` by real path, shared within one parse
+        self.parents = {} if parents is None else parents
 
     def create_generator(self, file_path):
-        with open(file_path, "r") as f:
-            for n, line in enumerate(f.read().splitlines(), start=1):
-                skip_line = False
-                char_prev = None
-                for char in line:
-                    if char == " ":
-                        continue
-                    elif char == "#":
-                        skip_line = True
-                        break
-                    elif char_prev == "x" and char == "-":
-                        skip_line = True
-                        break
-                    else:
-                        char_prev = char
-                if not skip_line:
-                    yield n, line
-        yield n + 1, None
+        with open(file_path, "r", buffering=65536) as f:
+            for n, line in enumerate(f, start=1):
+                line = line.rstrip("\r\n")
+                # skip blank lines, comments and x- extension keys, also after tabs
+                content = line.lstrip()
+                if not content or content[0] == "#" or content.startswith("x-"):
+                    continue
+                # the indentation is counted in spaces only
+                yield n, line, line.lstrip(" ")
 
     def move_to_next_line(self):
-        try:
-            self.n, self.line = next(self.generator)
-        except:
-            pass
+        # the generator yields tuples, so None marks its end
+        item = next(self.generator, None)
+        if item is None:
+            self.line = None
+            self.stripped = None
+            self.indent = 0
+        else:
+            self.n, self.line, self.stripped = item
+            self.indent = len(self.line) - len(self.stripped)
 
     def __str__(self):
         return f"{self.n}: {self.line}"
@@ -1175,46 +1214,74 @@ class LineReader:
         return self.__str__()
 
 
-def validate_string(s, additional_chars=None):
-    if additional_chars is None:
-        additional_chars = []
-    for invalid_char in [" ", ": "] + additional_chars:
-        if invalid_char in s:
-            raise ParsingError()
+@lru_cache(maxsize=512)
+def validate_string(s):
+    if " " in s:
+        raise ParsingError()
+    return s
+
+
+# a key without whitespace or colons and a colon, optionally followed by whitespace and a value,
+# the value is greedy and ends on a non-space, so trailing whitespace is not backtracked over
+_KEY_VALUE_RE = re.compile(r"([^\s:]+):(?:\s+(.*\S))?\s*")
+
+
+def strip_comment(s):
+    # a "#" at the start or after whitespace begins a comment, unless it is quoted
+    if "#" not in s:
+        return s
+    quote = None
+    for i, c in enumerate(s):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c == "#" and (i == 0 or s[i - 1].isspace()):
+            return s[:i].rstrip()
     return s
 
 
+@lru_cache(maxsize=512)
 def get_key_and_potential_value(s):
-    key = None
-    value = None
-    if s[-1] == ":":
-        key = validate_string(s[:-1], [":"])
-    else:
-        key_value_list = s.split(": ")
-        if len(key_value_list) != 2:
-            raise ParsingError()
-        key = validate_string(key_value_list[0])
-        value = key_value_list[1].lstrip()
-        if value == "" or value.isspace():
-            value = None
-    return key, value
+    match = _KEY_VALUE_RE.fullmatch(s)
+    if match is None:
+        raise ParsingError()
+    key, value = match.groups()
+    if value is not None:
+        value = strip_comment(value)
+    return key, value or None
+
+
+@lru_cache(maxsize=256)
+def split_command(s):
+    # shlex.split(None) would read the command from stdin
+    if s is None:
+        raise ParsingError()
+    # non-posix mode keeps quotes, so quoted arguments are passed on verbatim
+    try:
+        return tuple(shlex.split(s, posix=False))
+    except ValueError as ex:
+        raise ParsingError(str(ex)) from ex
+
+
+_REDUNDANT_SLASHES_RE = re.compile(r"/(?:\./|/)+")
 
 
 def remove_redundant_slashes(path):
-    return path.replace("//", "/").replace("/./", "/")
+    return _REDUNDANT_SLASHES_RE.sub("/", path)
 
 
 def parse_volumes(lr, cs):
     lr.move_to_next_line()
     while lr.line is not None:
-        if lr.line[:6] == "      " and lr.line[6] == "-":
-            vol = lr.line[7:].lstrip().rstrip()
-            if vol.count(":") not in [1, 2]:
+        if lr.indent == 6 and lr.stripped[0] == "-":
+            vol_parts = strip_comment(lr.stripped[1:].strip()).split(":")
+            if len(vol_parts) not in [2, 3]:
                 raise ParsingError()
             else:
-                vol = ":".join(vol.split(":")[:2])
-                vol_container = vol.split(":")[1]
-                cs.volumes[vol_container] = vol
+                vol_host, vol_container = vol_parts[:2]
+                cs.volumes[vol_container] = f"{vol_host}:{vol_container}"
         else:
             break
         lr.move_to_next_line()
@@ -1224,8 +1291,8 @@ def parse_volumes(lr, cs):
 def parse_environment(lr, cs):
     lr.move_to_next_line()
     while lr.line is not None:
-        if lr.line[:6] == "      " and lr.line[6] != " ":
-            key, value = get_key_and_potential_value(lr.line[6:])
+        if lr.indent == 6:
+            key, value = get_key_and_potential_value(lr.stripped)
             if value == "null":
                 value = None
             elif (value[0] == '"' and value[-1] == '"') or (value[0] == "'" and value[-1] == "'"):
@@ -1243,39 +1310,46 @@ def parse_extends(lr, cs):
     parent_service_name = None
     parent_file_location = None
     while lr.line is not None:
-        if lr.line[:6] == "      " and lr.line[6] != " ":
-            key, value = get_key_and_potential_value(lr.line[6:])
+        if lr.indent == 6:
+            key, value = get_key_and_potential_value(lr.stripped)
             if key == "file":
                 parent_file_location = value
-                parent_csc = state_start(LineReader(value), ComposeServiceContainer())
+                parent_file_path = os.path.realpath(value)
+                parent_csc = lr.parents.get(parent_file_path)
+                if parent_csc is None:
+                    parent_lr = LineReader(value, lr.parents)
+                    parent_csc = state_start(parent_lr, ComposeServiceContainer())
+                    lr.parents[parent_file_path] = parent_csc
             elif key == "service":
                 parent_service_name = value
-        if lr.line[:4] == "    " and lr.line[4] != " ":
+        elif lr.indent <= 4:
             break
         lr.move_to_next_line()
     if parent_csc is None or parent_service_name is None:
         raise ParsingError()
-    parent_cs = None
-    for parent_cs_potential in parent_csc.compose_services:
-        if parent_cs_potential.name == parent_service_name:
-            parent_cs = parent_cs_potential
+    parent_cs = parent_csc.by_name(parent_service_name)
     if parent_cs is None:
         raise ParsingError()
-    for key, value in cs.__dict__.items():
+    # copied, as the cached parent must not be altered by the child
+    parent_cs = deepcopy(parent_cs)
+    for key in cs.__slots__:
+        value = getattr(cs, key)
         if value:
-            parent_cs.__setattr__(key, value)
+            setattr(parent_cs, key, value)
     parent_file_folder = parent_file_location.rsplit("/", 1)[0]
     if parent_cs.build:
         if parent_cs.build == ".":
             parent_cs.build = parent_file_folder
         else:
-            parent_build = remove_redundant_slashes(parent_file_folder + "/" + parent_cs.build)
-            parent_cs.build = parent_build
-        parent_cs.def_file = remove_redundant_slashes(parent_file_folder + "/" + parent_cs.def_file)
-        parent_cs.sif_file = remove_redundant_slashes(parent_file_folder + "/" + parent_cs.sif_file)
+            parent_build = os.path.join(parent_file_folder, parent_cs.build)
+            parent_cs.build = remove_redundant_slashes(parent_build)
+        parent_def_file = os.path.join(parent_file_folder, parent_cs.def_file)
+        parent_cs.def_file = remove_redundant_slashes(parent_def_file)
+        parent_sif_file = os.path.join(parent_file_folder, parent_cs.sif_file)
+        parent_cs.sif_file = remove_redundant_slashes(parent_sif_file)
     volumes_new = {}
     for k, v in parent_cs.volumes.items():
-        volumes_new[k] = remove_redundant_slashes(parent_file_folder + "/" + v)
+        volumes_new[k] = remove_redundant_slashes(os.path.join(parent_file_folder, v))
     parent_cs.volumes = volumes_new
     return parent_cs
 
@@ -1283,8 +1357,8 @@ def parse_extends(lr, cs):
 def state_individual_service(lr, cs):
     lr.move_to_next_line()
     while lr.line is not None:
-        if lr.line[:4] == "    " and lr.line[4] != " ":
-            key, value = get_key_and_potential_value(lr.line[4:])
+        if lr.indent == 4:
+            key, value = get_key_and_potential_value(lr.stripped)
             if key == "image":
                 cs.image = "docker://" + validate_string(value)
             elif key == "build":
@@ -1293,14 +1367,18 @@ def state_individual_service(lr, cs):
                     cs.def_file = cs.name + ".def"
                     cs.sif_file = cs.name + ".sif"
             elif key == "command":
-                cs.run_command = value.split(" ")
+                cs.run_command = list(split_command(value))
             elif key == "volumes":
-                if value is None:
-                    cs = parse_volumes(lr, cs)
+                # only the block form is supported, not an inline list
+                if value is not None:
+                    raise ParsingError()
+                cs = parse_volumes(lr, cs)
                 continue
             elif key == "environment":
-                if value is None:
-                    cs = parse_environment(lr, cs)
+                # only the block form is supported, not an inline mapping
+                if value is not None:
+                    raise ParsingError()
+                cs = parse_environment(lr, cs)
                 continue
             elif key == "extends":
                 cs = parse_extends(lr, cs)
@@ -1309,6 +1387,9 @@ def state_individual_service(lr, cs):
                 warnings.warn(f"'{key}' is not supported. Ignoring", UserWarning)
             else:
                 raise ParsingError()
+        elif lr.indent < 4:
+            # the next service or top level key, left for the caller
+            break
         lr.move_to_next_line()
     return cs
 
@@ -1316,15 +1397,18 @@ def state_individual_service(lr, cs):
 def state_root_services(lr, csc):
     lr.move_to_next_line()
     while lr.line is not None:
-        if lr.line[:2] == "  " and lr.line[2] != " ":
-            service_name, value = get_key_and_potential_value(lr.line[2:])
+        if lr.indent == 2:
+            service_name, value = get_key_and_potential_value(lr.stripped)
             if value is not None:
                 raise ParsingError()
             else:
                 cs = ComposeService()
                 cs.name = service_name
                 cs = state_individual_service(lr, cs)
-                csc.compose_services.append(cs)
+                csc.add(cs)
+                continue
+        elif lr.indent == 0:
+            break
         lr.move_to_next_line()
     return csc
 
@@ -1334,6 +1418,7 @@ def state_start(lr, csc):
     while lr.line is not None:
         if lr.line.startswith("services:"):
             state_root_services(lr, csc)
+            continue
         lr.move_to_next_line()
     return csc
 
@@ -1341,7 +1426,7 @@ def state_start(lr, csc):
 # - main -------------------------------------------------------------------------------------------
 
 
-def parse():
+def parse_cli():
     parser = argparse.ArgumentParser(prog="apptainer_compose.py", description="Apptainer Compose")
     parser.add_argument("-f", "--file", help="file")
     parser.add_argument("-v", "--verbose", action="store_true", help="verbose")
@@ -1369,36 +1454,79 @@ def parse():
             print(args.run_command)
         if args.COMMAND == "up":
             print(f"writable-tmpfs: {args.writable_tmpfs}")
+    return args
+
+
+def parse_file(file_path):
+    return state_start(LineReader(file_path), ComposeServiceContainer())
 
-    csc = ComposeServiceContainer()
+
+def parse():
+    args = parse_cli()
+    csc = parse_file(args.file)
     csc.args = args
-    return state_start(LineReader(args.file), csc)
+    return csc
 
 
 def execute(cs, args):
+    cmd_as_list = cs.command_to_list(args)
+    output = [cs.command_to_str(args, cmd_as_list)]
     if args.verbose:
-        print(cs.name)
-        print(cs)
-    print(cs.command_to_str(args))
+        output = [cs.name, str(cs)] + output
+    # written at once and flushed, so it precedes the output of the started process
+    print("\n".join(output), flush=True)
     if not args.dry_run:
-        cmd_as_list = cs.command_to_list(args)
-        subprocess.run(cmd_as_list)
+        return subprocess.Popen(cmd_as_list)
+    return None
+
+
+def exit_code(returncode):
+    # a process killed by a signal has a negative return code, reported like a shell does
+    if returncode < 0:
+        return 128 - returncode
+    return returncode
 
 
 def main():
     csc = parse()
-    for cs in csc.compose_services:
+    compose_services = csc.compose_services
+    if csc.args.COMMAND == "run":
+        # only the named service is run, as it may be attached to the terminal
+        cs = csc.by_name(csc.args.service_name)
+        if cs is None:
+            print("Service %s is not defined in %s." % (csc.args.service_name, csc.args.file))
+            sys.exit(1)
+        compose_services = [cs]
+    processes = []
+    for cs in compose_services:
+        # like docker compose, build skips services that only use an image
+        if csc.args.COMMAND == "build" and cs.build is None:
+            continue
         if csc.args.COMMAND == "build" or (
             csc.args.COMMAND == "up"
             and not csc.args.dry_run
             and cs.sif_file is not None
             and not os.path.exists(cs.sif_file)
         ):
-            convert_dockerfile_to_apptainer(cs.build, cs.def_file)
+            convert_dockerfile_to_apptainer(cs.build, cs.def_file, csc.args.verbose)
             build_args = copy(csc.args)
             build_args.COMMAND = "build"
-            execute(cs, build_args)
-        execute(cs, csc.args)
+            build_process = execute(cs, build_args)
+            # a service can only be run once its image is built
+            if build_process is not None and build_process.wait() != 0:
+                # stop the services already started instead of leaving them behind
+                for process in processes:
+                    process.terminate()
+                for process in processes:
+                    process.wait()
+                sys.exit(exit_code(build_process.returncode))
+            if csc.args.COMMAND == "build":
+                continue
+        process = execute(cs, csc.args)
+        if process is not None:
+            processes.append(process)
+    # the services are independent, so they run concurrently
+    sys.exit(max((exit_code(process.wait()) for process in processes), default=0))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+set -e
+
+../../../apptainer_compose.py build
@@ -9,6 +9,10 @@ from apptainer_compose import parse, ParsingError
 
 tests_target_list = [
     ("invalid_1", None),
+    ("invalid_empty_command", None),
+    ("invalid_inline_environment", None),
+    ("invalid_inline_volumes", None),
+    ("invalid_unclosed_quote", None),
     ("semivalid_networks", 'apptainer run docker://alpine:latest echo "semivalid_networks"'),
     ("valid_alpine_command", 'apptainer run docker://alpine:latest echo "valid_alpine_command"'),
     (
@@ -29,6 +33,12 @@ tests_target_list = [
             "apptainer run valid_build.sif",
         ],
     ),
+    (
+        "valid_build_and_image",
+        (
+            "apptainer build -F valid_build_and_image_app.sif valid_build_and_image_app.def",
+        ),
+    ),
     (
         "valid_ghcr",
         'apptainer run docker://ghcr.io/linuxcontainers/alpine:latest echo "valid_ghcr"',
@@ -55,6 +65,20 @@ tests_target_list = [
             + "docker://alpine:latest cat /out_parent_1/compose.yaml"
         ),
     ),
+    (
+        "valid_inline_comments",
+        (
+            "apptainer run --bind ./:/mount/ --env var_1='bla # ble' docker://alpine:latest "
+            + 'echo "valid_inline_comments"'
+        ),
+    ),
+    (
+        "valid_multiple_services",
+        (
+            'apptainer run docker://alpine:latest echo "valid_multiple_services_1"',
+            'apptainer run docker://alpine:latest echo "valid_multiple_services_2"',
+        ),
+    ),
     ("valid_up_and_build", "apptainer run valid_up_and_build.sif"),
     ("valid_veld", 'apptainer run docker://alpine:latest echo "valid_veld"'),
     (
@@ -71,19 +95,28 @@ def main_test(tests_target_list):
         os.chdir("./compose_files/" + folder)
         with open("./test.sh", "r") as f:
             command_counter = 0
-            for line in f.readlines():
+            for line in f:
                 sys.argv = None
                 if line.startswith("../../../apptainer_compose.py"):
                     sys.argv = line.split()
                     try:
                         print(f"{sys.argv=}")
                         csc = parse()
-                        cs = csc.compose_services[0]
-                        parsed_command = cs.command_to_str(csc.args)
+                        if type(target) is tuple:
+                            # one target per service, so all services are checked
+                            parsed_command = tuple(
+                                cs.command_to_str(csc.args)
+                                for cs in csc.compose_services
+                                # build skips services without a build context, as main does
+                                if csc.args.COMMAND != "build" or cs.build is not None
+                            )
+                        else:
+                            cs = csc.compose_services[0]
+                            parsed_command = cs.command_to_str(csc.args)
                     except ParsingError as ex:
                         print(ex)
                         parsed_command = None
-                    if type(target) in [str, type(None)]:
+                    if type(target) in [str, tuple, type(None)]:
                         current_target = target
                     elif type(target) is list:
                         current_target = target[command_counter]